@@ -4,11 +4,22 @@
    these values should not be changed. The device can be either
    "cpu" or "gpu", which then optimizes the model accordingly after
    training or uses the correct version for inference when testing.
+   The test batch size sets how many video frames are processed in
+   a single forward pass of the network during testing. Caching
+   videos stores their decoded frames uncompressed next to the input
+   files, which avoids decoding them again in later test runs, but
+   takes up a lot of disk space. Caching images does the same for the
+   decoded training set, which is then only partly shuffled after the
+   first epoch. To reproduce the results from the paper, it should
+   remain disabled.
 """
 
 PARAMS = {
     "n_epochs": 10,
     "batch_size": 1,
+    "test_batch_size": 100,
+    "cache_videos": False,
+    "cache_images": False,
     "learning_rate": 1e-5,
     "device": "gpu"
 }
@@ -1,5 +1,10 @@
+import glob
 import os
+import queue
+import shutil
+import subprocess
 import sys
+import threading
 
 import cv2
 import numpy as np
@@ -8,6 +13,11 @@ import tensorflow as tf
 import config
 import download
 
+_FILE_LIST_CACHE = {}
+_PROBE_CACHE = {}
+_NVENC_AVAILABLE = None
+
+
 class SALICON:
     """This class represents the SALICON dataset. It consists of 10000 training
        and 5000 validation images. The corresponding mouse tracking maps were
@@ -39,6 +49,8 @@ class SALICON:
         self._dir_saliency_train = data_path + "saliency/train"
         self._dir_saliency_valid = data_path + "saliency/val"
 
+        self._dir_cache = data_path + "cache/"
+
         if not os.path.exists(data_path):
             parent_path = os.path.dirname(data_path[:-1])
             parent_path = os.path.join(parent_path, "")
@@ -52,7 +64,8 @@ class SALICON:
         _check_consistency(zip(train_list_x, train_list_y), 10000)
 
         train_set = _fetch_dataset((train_list_x, train_list_y),
-                                   self._target_size, True)
+                                   self._target_size, True,
+                                   self._dir_cache + "train")
 
         valid_list_x = _get_file_list(self._dir_stimuli_valid)
         valid_list_y = _get_file_list(self._dir_saliency_valid)
@@ -60,7 +73,8 @@ class SALICON:
         _check_consistency(zip(valid_list_x, valid_list_y), 5000)
 
         valid_set = _fetch_dataset((valid_list_x, valid_list_y),
-                                   self._target_size, False)
+                                   self._target_size, False,
+                                   self._dir_cache + "valid")
 
         return (train_set, valid_set)
 
@@ -93,6 +107,8 @@ class MIT1003:
         self._dir_stimuli = data_path + "stimuli"
         self._dir_saliency = data_path + "saliency"
 
+        self._dir_cache = data_path + "cache/"
+
         if not os.path.exists(data_path):
             parent_path = os.path.dirname(data_path[:-1])
             parent_path = os.path.join(parent_path, "")
@@ -105,22 +121,27 @@ class MIT1003:
 
         _check_consistency(zip(list_x, list_y), 1003)
 
+        list_x = np.array(list_x, dtype=object)
+        list_y = np.array(list_y, dtype=object)
+
         indices = _get_random_indices(1003)
         excerpt = indices[:self.n_train]
 
-        train_list_x = [list_x[idx] for idx in excerpt]
-        train_list_y = [list_y[idx] for idx in excerpt]
+        train_list_x = list_x[excerpt].tolist()
+        train_list_y = list_y[excerpt].tolist()
 
         train_set = _fetch_dataset((train_list_x, train_list_y),
-                                   self._target_size, True)
+                                   self._target_size, True,
+                                   self._dir_cache + "train")
 
         excerpt = indices[self.n_train:]
 
-        valid_list_x = [list_x[idx] for idx in excerpt]
-        valid_list_y = [list_y[idx] for idx in excerpt]
+        valid_list_x = list_x[excerpt].tolist()
+        valid_list_y = list_y[excerpt].tolist()
 
         valid_set = _fetch_dataset((valid_list_x, valid_list_y),
-                                   self._target_size, False)
+                                   self._target_size, False,
+                                   self._dir_cache + "valid")
 
         return (train_set, valid_set)
 
@@ -153,6 +174,8 @@ class CAT2000:
         self._dir_stimuli = data_path + "stimuli"
         self._dir_saliency = data_path + "saliency"
 
+        self._dir_cache = data_path + "cache/"
+
         if not os.path.exists(data_path):
             parent_path = os.path.dirname(data_path[:-1])
             parent_path = os.path.join(parent_path, "")
@@ -165,33 +188,34 @@ class CAT2000:
 
         _check_consistency(zip(list_x, list_y), 2000)
 
+        list_x = np.array(list_x, dtype=object)
+        list_y = np.array(list_y, dtype=object)
+
         indices = _get_random_indices(100)
 
         # sample uniformly from all 20 categories
         ratio = self.n_train * 100 // 2000
         excerpt = np.tile(indices[:ratio], 20)
+        excerpt += np.arange(len(excerpt)) // ratio * 100
 
-        for idx, _ in enumerate(excerpt):
-            excerpt[idx] = excerpt[idx] + idx // ratio * 100
-
-        train_list_x = [list_x[idx] for idx in excerpt]
-        train_list_y = [list_y[idx] for idx in excerpt]
+        train_list_x = list_x[excerpt].tolist()
+        train_list_y = list_y[excerpt].tolist()
 
         train_set = _fetch_dataset((train_list_x, train_list_y),
-                                   self._target_size, True)
+                                   self._target_size, True,
+                                   self._dir_cache + "train")
 
         # sample uniformly from all 20 categories
         ratio = self.n_valid * 100 // 2000
         excerpt = np.tile(indices[-ratio:], 20)
+        excerpt += np.arange(len(excerpt)) // ratio * 100
 
-        for idx, _ in enumerate(excerpt):
-            excerpt[idx] = excerpt[idx] + idx // ratio * 100
-
-        valid_list_x = [list_x[idx] for idx in excerpt]
-        valid_list_y = [list_y[idx] for idx in excerpt]
+        valid_list_x = list_x[excerpt].tolist()
+        valid_list_y = list_y[excerpt].tolist()
 
         valid_set = _fetch_dataset((valid_list_x, valid_list_y),
-                                   self._target_size, False)
+                                   self._target_size, False,
+                                   self._dir_cache + "valid")
 
         return (train_set, valid_set)
 
@@ -207,20 +231,16 @@ class TEST:
                 specified under the path variable.
     """
 
-    def __init__(self, dataset, data_path, video_file):
+    def __init__(self, dataset, data_path, video_files):
         self._target_size = config.DIMS["image_size_%s" % dataset]
-        self.video_file = video_file
-        self._dir_stimuli_test = data_path
+        self._video_files = video_files
 
     def load_data(self):
-        test_list_x = _get_file_list(self._dir_stimuli_test)
-
-        test_set = _fetch_dataset(test_list_x, self._target_size,
-                                  False, self.video_file, online=True)
+        test_set = _fetch_video_dataset(self._video_files, self._target_size)
         return test_set
 
 
-def get_dataset_iterator(phase, dataset, data_path, video_file):
+def get_dataset_iterator(phase, dataset, data_path, video_files=None):
     """Entry point to make an initializable dataset iterator for either
        training or testing a model by calling the respective dataset class.
 
@@ -230,10 +250,17 @@ def get_dataset_iterator(phase, dataset, data_path, video_file):
                        suitable resizing procedure when testing a model.
         data_path (str): Points to the directory where training or testing
                          data instances are stored.
+        video_files (tensor, str, optional): 1D tensor with the paths to the
+                                             video files that are decoded
+                                             when testing. Defaults to None.
 
     Returns:
-        iterator: An initializable dataset iterator holding the relevant data.
-        initializer: An operation required to initialize the correct iterator.
+        tuple: When testing, the next element of an initializable iterator
+               holding the relevant data and the operation required to
+               initialize it. When training, the next element of a feedable
+               iterator, the string handle placeholder that selects between
+               the training and validation set, and the initializable
+               iterators of both sets.
     """
 
     if phase == "train":
@@ -243,24 +270,33 @@ def get_dataset_iterator(phase, dataset, data_path, video_file):
         dataset_class = getattr(current_module, class_name)(data_path)
         train_set, valid_set = dataset_class.load_data()
 
-        iterator = tf.data.Iterator.from_structure(train_set.output_types,
-                                                   train_set.output_shapes)
+        # both sets keep their own iterator, so that switching between them
+        # does not discard the prefetched batches
+        handle = tf.placeholder(tf.string, shape=[])
+
+        iterator = tf.data.Iterator.from_string_handle(handle,
+                                                       train_set.output_types,
+                                                       train_set.output_shapes)
         next_element = iterator.get_next()
 
-        train_init_op = iterator.make_initializer(train_set)
-        valid_init_op = iterator.make_initializer(valid_set)
+        train_iterator = train_set.make_initializable_iterator()
+        valid_iterator = valid_set.make_initializable_iterator()
 
-        return next_element, train_init_op, valid_init_op
+        return next_element, handle, train_iterator, valid_iterator
 
     if phase == "test":
-        test_class = TEST(dataset, data_path, video_file)
+        test_class = TEST(dataset, data_path, video_files)
         test_set = test_class.load_data()
 
-        iterator = tf.data.Iterator.from_structure(test_set.output_types,
-                                                   test_set.output_shapes)
-        next_element = iterator.get_next()
+        # prefetching to the gpu requires an iterator created from the dataset
+        iterator = test_set.make_initializable_iterator()
+        input_images, file_path = iterator.get_next()
 
-        init_op = iterator.make_initializer(test_set)
+        # frames are only cast after the transfer to keep it 4 times smaller
+        input_images = tf.cast(input_images, tf.float32)
+        next_element = (input_images, file_path)
+
+        init_op = iterator.initializer
 
         return next_element, init_op
 
@@ -288,85 +324,641 @@ def postprocess_saliency_map(saliency_map, target_size):
     saliency_map = tf.round(saliency_map)
     saliency_map = tf.cast(saliency_map, tf.uint8)
 
-    saliency_map_jpeg = tf.image.encode_jpeg(saliency_map, "grayscale", 100)
+    saliency_map_jpeg = tf.image.encode_jpeg(saliency_map, "grayscale", 95)
 
     return saliency_map_jpeg
 
-def _fetch_dataset(files, target_size, shuffle, video_file, online=False):
-    """Here the list of file directories is shuffled (only when training),
-       loaded, batched, and prefetched to ensure high GPU utilization.
+
+def get_video_writer(path, frame_size, fps=25):
+    """Opens a writer for grayscale saliency videos. On gpu devices, frames
+       are encoded by the dedicated H.264 encoder via FFmpeg when a test
+       encode with NVENC succeeds, which keeps encoding off the processor.
+       Otherwise, the XVID encoder of OpenCV is used.
+
+    Args:
+        path (str): The path to the output video file.
+        frame_size (tuple, int): The width and height of the video frames.
+        fps (int): The frame rate of the output video.
+
+    Returns:
+        object: A writer with write and release methods for uint8 frames.
+    """
+
+    if config.PARAMS["device"] == "gpu" and _has_nvenc():
+        return _NVENCVideoWriter(path, frame_size, fps)
+
+    fourcc = cv2.VideoWriter_fourcc(*"XVID")
+
+    return cv2.VideoWriter(path, fourcc, fps, frame_size, False)
+
+
+class _NVENCVideoWriter:
+    """This class streams grayscale frames to an FFmpeg subprocess that
+       encodes them with h264_nvenc. It mirrors the write and release
+       methods of cv2.VideoWriter.
+    """
+
+    def __init__(self, path, frame_size, fps):
+        command = ["ffmpeg", "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", "gray",
+                   "-s", "%ix%i" % tuple(frame_size), "-r", str(fps),
+                   "-i", "pipe:0", "-c:v", "h264_nvenc",
+                   "-pix_fmt", "yuv420p", path]
+
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self._process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+
+    def release(self):
+        self._process.stdin.close()
+
+        if self._process.wait():
+            raise RuntimeError("Video encoding with NVENC failed")
+
+
+def _has_nvenc():
+    """Checks once whether NVENC can actually be used by encoding a single
+       test frame with h264_nvenc. Merely listing the encoder is not enough,
+       since FFmpeg builds include it on machines without a suitable gpu or
+       driver.
+
+    Returns:
+        bool: True if the test frame was encoded successfully.
+    """
+
+    global _NVENC_AVAILABLE
+
+    if _NVENC_AVAILABLE is None:
+        command = ["ffmpeg", "-nostdin", "-loglevel", "error",
+                   "-f", "lavfi", "-i", "color=s=256x256",
+                   "-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-"]
+
+        try:
+            returncode = subprocess.run(command,
+                                        stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL).returncode
+            _NVENC_AVAILABLE = returncode == 0
+        except OSError:
+            _NVENC_AVAILABLE = False
+
+    return _NVENC_AVAILABLE
+
+
+def _fetch_dataset(files, target_size, shuffle, cache_path):
+    """Here the stimuli and ground truth maps are first packed into sharded
+       TFRecord files, which are then read in parallel. The decoded validation
+       instances are cached on disk during the first epoch, whereas training
+       instances are only cached when enabled in the config file. They are
+       then shuffled (only when training), batched, repeated indefinitely, and
+       prefetched to ensure high GPU utilization.
 
     Args:
-        files (list, str): A list that holds the paths to all file instances.
+        files (tuple, str): A tuple of lists that hold the paths to all
+                            stimuli and ground truth maps respectively.
         target_size (tuple, int): A tuple that specifies the size to which
                                   the data will be reshaped.
         shuffle (bool): Determines whether the dataset will be shuffled or not.
-        online (bool, optional): Flag that decides whether the batch size must
-                                 be 1 or can take any value. Defaults to False.
+        cache_path (str): The path prefix of the cache files, which is
+                          extended by the target size.
 
     Returns:
         object: A dataset object that contains the batched and prefetched data
                 instances along with their shapes and file paths.
     """
-    # if shuffle:
-    #     dataset = dataset.shuffle(len(files[0]))
-    #
-    # dataset = dataset.map(lambda *files: _tf_parse_video_files(files, target_size),
-    #                       num_parallel_calls=4)
-
-    video, original_size, files = _tf_parse_video_files([video_file], target_size)
-    # We process the video 50 frames at a time
-    dataset = tf.data.Dataset.from_tensor_slices(video)
-    dataset = dataset.map(lambda frame: (frame, original_size, files))
-    dataset = dataset.batch(100)
-    dataset = dataset.prefetch(2)
+
+    n_samples = len(files[0])
+
+    # a cached training set would keep its order and only be shuffled partly
+    use_cache = not shuffle or config.PARAMS["cache_images"]
+
+    cache_file = cache_path + "_%ix%i" % target_size
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    # an interrupted first epoch leaves a lockfile that blocks later runs
+    if use_cache and not os.path.isfile(cache_file + ".index"):
+        for leftover_file in glob.glob(cache_file + "_*") + \
+                             glob.glob(cache_file + ".data-*"):
+            os.remove(leftover_file)
+
+    # records are only read to fill the decoded cache, so they are removed
+    # once the cache is complete
+    if use_cache and os.path.isfile(cache_file + ".index"):
+        record_files = _get_record_files(cache_path)
+
+        for record_file in record_files + [cache_path + ".count"]:
+            if os.path.isfile(record_file):
+                os.remove(record_file)
+    else:
+        record_files = _write_tfrecords(files, cache_path)
+
+    dataset = tf.data.Dataset.from_tensor_slices(record_files)
+
+    if shuffle:
+        dataset = dataset.shuffle(len(record_files))
+
+    dataset = dataset.interleave(
+        tf.data.TFRecordDataset, cycle_length=8,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    # the encoded records are small enough to shuffle the whole set
+    if shuffle:
+        dataset = dataset.shuffle(n_samples)
+
+    dataset = dataset.map(lambda record: _parse_image_record(record,
+                                                             target_size),
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    if use_cache:
+        dataset = dataset.cache(cache_file)
+
+        # decoded instances are large, so the buffer only holds a part of them
+        if shuffle:
+            dataset = dataset.shuffle(min(n_samples, 1000))
+
+    dataset = dataset.batch(config.PARAMS["batch_size"])
+
+    # the pipeline stays alive across all epochs instead of being rebuilt
+    dataset = dataset.repeat()
+
+    # prefetching to the gpu is not possible here, since the train and valid
+    # sets share a feedable iterator
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    options.experimental_optimization.map_fusion = True
+
+    dataset = dataset.with_options(options)
+
+    return dataset
+
+
+def _get_record_files(record_path, n_shards=16):
+    """A helper function that names the sharded TFRecord files of a set.
+
+    Args:
+        record_path (str): The path prefix of the TFRecord files.
+        n_shards (int, optional): The number of TFRecord files.
+                                  Defaults to 16.
+
+    Returns:
+        list, str: A list with the paths to all TFRecord files.
+    """
+
+    return [record_path + "-%05i-of-%05i.tfrecord" % (shard, n_shards)
+            for shard in range(n_shards)]
+
+
+def _write_tfrecords(files, record_path, n_shards=16):
+    """Packs the encoded stimuli and ground truth maps together with their
+       paths into sharded TFRecord files, unless these already exist and hold
+       the expected number of instances, which is kept in a count file next
+       to them. Reading a few large files replaces opening every single image.
+       The shards of a set are removed again once its decoded cache is
+       complete, since they are not read anymore.
+
+    Args:
+        files (tuple, str): A tuple of lists that hold the paths to all
+                            stimuli and ground truth maps respectively.
+        record_path (str): The path prefix of the TFRecord files.
+        n_shards (int, optional): The number of TFRecord files written.
+                                  Defaults to 16.
+
+    Returns:
+        list, str: A list with the paths to all TFRecord files.
+    """
+
+    record_files = _get_record_files(record_path, n_shards)
+    count_file = record_path + ".count"
+
+    # the number of instances is stored once, so the shards are not read here
+    if os.path.isfile(count_file) and \
+       all(os.path.isfile(record_file) for record_file in record_files):
+        with open(count_file) as file:
+            n_records = int(file.read() or -1)
+
+        if n_records == len(files[0]):
+            return record_files
+
+    writers = [tf.python_io.TFRecordWriter(record_file + ".tmp")
+               for record_file in record_files]
+
+    for count, (stimulus_path, saliency_path) in enumerate(zip(*files)):
+        with open(stimulus_path, "rb") as file:
+            stimulus = file.read()
+
+        with open(saliency_path, "rb") as file:
+            saliency = file.read()
+
+        feature = {
+            "stimulus": _bytes_feature(stimulus),
+            "saliency": _bytes_feature(saliency),
+            "stimulus_path": _bytes_feature(stimulus_path.encode()),
+            "saliency_path": _bytes_feature(saliency_path.encode())
+        }
+
+        example = tf.train.Example(features=tf.train.Features(feature=feature))
+
+        writers[count % n_shards].write(example.SerializeToString())
+
+    for writer, record_file in zip(writers, record_files):
+        writer.close()
+        os.replace(record_file + ".tmp", record_file)
+
+    with open(count_file, "w") as file:
+        file.write(str(len(files[0])))
+
+    return record_files
+
+
+def _bytes_feature(value):
+    """Wraps a byte string into a feature of a TFRecord example.
+
+    Args:
+        value (bytes): The byte string to be stored.
+
+    Returns:
+        object: A feature that holds the byte string.
+    """
+
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _fetch_video_dataset(files, target_size):
+    """Here the video files are decoded in parallel, while their frames are
+       still emitted one file after another. The next videos are opened and
+       decoded ahead of time, which hides their startup latency behind the
+       inference of the current file. Batches are then prefetched to the GPU
+       memory to ensure high GPU utilization.
+
+    Args:
+        files (tensor, str): 1D tensor that holds the paths to all videos.
+        target_size (tuple, int): A tuple that specifies the size to which
+                                  the data will be reshaped.
+
+    Returns:
+        object: A dataset object that contains the batched and prefetched data
+                instances along with their file paths.
+    """
+
+    # decoding errors are ignored later, which would hide a missing decoder
+    if shutil.which("ffmpeg") is None:
+        raise FileNotFoundError("FFmpeg is required for decoding videos")
+
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+
+    # a cycle length of 1 keeps the frames of each video together and in order
+    dataset = dataset.apply(tf.data.experimental.parallel_interleave(
+        lambda video_file: _fetch_video_frames(video_file, target_size),
+        cycle_length=1, sloppy=False, buffer_output_elements=2,
+        prefetch_input_elements=3))
+
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    if config.PARAMS["device"] == "gpu":
+        prefetch_op = tf.data.experimental.prefetch_to_device("/gpu:0")
+        dataset = dataset.apply(prefetch_op)
+
+    return dataset
+
+
+def _fetch_video_frames(video_file, target_size):
+    """The resized and padded frames of a single video file are streamed from
+       the decoder in batches. Batches are formed per video, so that they
+       only hold frames of the same file.
+
+    Args:
+        video_file (tensor, str): 0D tensor with the path to the video file.
+        target_size (tuple, int): A tuple that specifies the size to which
+                                  the data will be reshaped.
+
+    Returns:
+        object: A dataset object that contains the batched frames of a video
+                together with its file path.
+    """
+
+    batch_size = config.PARAMS["test_batch_size"]
+
+    frames_shape = tf.TensorShape([None, target_size[0], target_size[1], 3])
+
+    dataset = tf.data.Dataset.from_generator(_generate_video_frames,
+                                             tf.uint8, frames_shape,
+                                             args=(video_file, target_size,
+                                                   batch_size))
+
+    # a corrupted video only ends its own frame stream instead of the run
+    dataset = dataset.apply(tf.data.experimental.ignore_errors())
+
+    # the constant file path is attached once per batch
+    file_paths = tf.data.Dataset.from_tensors(video_file).repeat()
+
+    dataset = tf.data.Dataset.zip((dataset, file_paths))
 
     return dataset
 
-def _tf_parse_video_files(files, target_size):
-  [image, original_size, files] = \
-        tf.py_func(_parse_video_files,
-            [files, target_size], [tf.float32, tf.int64, tf.string])
-  image.set_shape([None, target_size[0], target_size[1], 3])
-  return image, original_size, files
-
-def _parse_video_files(files, target_size):
-    assert len(files) == 1
-
-    frames_list = []
-
-    path_tensor = files[0]
-    path = path_tensor.decode("utf-8")
-
-    cap = cv2.VideoCapture(path)
-    while cap.isOpened():
-      ret, frame = cap.read()
-      if ret:
-        original_size = frame.shape[:2]
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image = _resize_image(image, target_size, is_numpy=True)
-        image = _np_pad_image(image, target_size)
-        image = image.astype(np.float32)
-
-        frames_list.append(image)
-      else:
-        break
-    cap.release()
-
-    # Stack all frames along the 0th dimension, as if there was a batch of frames to feed to the
-    # network.
-    video = np.stack(frames_list)
-    return video, original_size, files
-
-def _parse_image_files(files, target_size):
-    """This function reads image data dependent on the image type and
-       whether it constitutes a stimulus or saliency map. All instances
-       are then reshaped and padded to yield the target dimensionality.
+
+def _generate_video_frames(path, target_size, batch_size):
+    """This generator yields the batches of processed frames of a single video
+       file. When enabled in the config file, decoded frames are also written
+       to an uncompressed cache file next to the video, which later runs load
+       as a memory-mapped array instead of decoding the video again.
+
+    Args:
+        path (bytes): The encoded path to the video file.
+        target_size (array, int): An array that specifies the size to which
+                                  the data will be resized.
+        batch_size (int): The maximum number of frames per batch.
+
+    Yields:
+        array, uint8: 4D array that holds the values of padded frames.
+    """
+
+    path = path.decode("utf-8")
+
+    if not config.PARAMS["cache_videos"]:
+        yield from _decode_video(path, target_size, batch_size)
+        return
+
+    cache_path = "%s.%ix%i.u8.npy" % (path, target_size[0], target_size[1])
+
+    if os.path.isfile(cache_path) and \
+       os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        video = np.load(cache_path, mmap_mode="r")
+
+        for start in range(0, len(video), batch_size):
+            yield np.asarray(video[start:start + batch_size])
+
+        return
+
+    n_frames, _ = _probe_video(path)
+
+    temp_path = cache_path + ".tmp"
+    cache_file = _open_video_cache(temp_path, (n_frames, target_size[0],
+                                               target_size[1], 3))
+
+    count = 0
+    complete = False
+
+    try:
+        for frames in _decode_video(path, target_size, batch_size):
+            count += len(frames)
+
+            if cache_file is not None and count <= n_frames:
+                try:
+                    frames.tofile(cache_file)
+                except OSError:
+                    cache_file.close()
+                    os.remove(temp_path)
+
+                    cache_file = None
+
+            yield frames
+
+        complete = True
+    finally:
+        if cache_file is not None:
+            cache_file.close()
+
+            # the container frame count is only an estimate for some videos
+            if complete and count == n_frames:
+                os.replace(temp_path, cache_path)
+            else:
+                os.remove(temp_path)
+
+
+def _open_video_cache(path, shape):
+    """Creates a file in the npy format for the given shape of uint8 video
+       frames, which are then appended in decoding order. Regular writes are
+       used instead of a memory map, so a full disk raises an OSError.
+
+    Args:
+        path (str): The path of the cache file.
+        shape (tuple, int): The expected shape of the whole video.
+
+    Returns:
+        object: The opened file or None if it could not be created.
+    """
+
+    if shape[0] <= 0:
+        return None
+
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+              "fortran_order": False,
+              "shape": tuple(int(dim) for dim in shape)}
+
+    try:
+        cache_file = open(path, "wb")
+        np.lib.format.write_array_header_1_0(cache_file, header)
+    except OSError:
+        return None
+
+    return cache_file
+
+
+def _decode_video(path, target_size, batch_size):
+    """This generator decodes the frames of a single video file in one FFmpeg
+       subprocess, which also converts them to RGB, resizes them, and pads
+       them to the target dimensions in a single pass of native code. The raw
+       output is streamed in batches, each filled by a single read in a
+       separate thread, so that decoding overlaps with the rest of the input
+       pipeline.
+
+    Args:
+        path (str): The path to the video file.
+        target_size (array, int): An array that specifies the size to which
+                                  the data will be resized.
+        batch_size (int): The maximum number of frames per batch.
+
+    Yields:
+        array, uint8: 4D array that holds the values of padded frames.
+    """
+
+    _, original_size = _probe_video(path)
+
+    resized_size = _get_resized_size(original_size, target_size)
+
+    # the same interpolation methods as in _resize_image are used here
+    if original_size[0] > resized_size[0] or \
+       original_size[1] > resized_size[1]:
+        interpolation = "area"
+    else:
+        interpolation = "bicubic"
+
+    pad_top = (target_size[0] - resized_size[0]) // 2
+    pad_left = (target_size[1] - resized_size[1]) // 2
+
+    # padding in rgb24 keeps the constant value 126 exact, as in _pad_image
+    video_filter = "scale=%i:%i:flags=%s,format=rgb24," \
+                   "pad=%i:%i:%i:%i:color=0x7E7E7E" % (resized_size[1],
+                                                      resized_size[0],
+                                                      interpolation,
+                                                      target_size[1],
+                                                      target_size[0],
+                                                      pad_left, pad_top)
+
+    # without stdin, ffmpeg cannot consume input meant for the serve mode
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+
+    # decodes on the gpu if available, otherwise falls back to the cpu
+    if config.PARAMS["device"] == "gpu":
+        command += ["-hwaccel", "auto"]
+
+    command += ["-i", path, "-vf", video_filter, "-f", "rawvideo",
+                "-pix_fmt", "rgb24", "pipe:1"]
+
+    batch_shape = (batch_size, target_size[0], target_size[1], 3)
+
+    batches = queue.Queue(maxsize=2)
+    stop_event = threading.Event()
+
+    with subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE) as process:
+        reader = threading.Thread(target=_read_video_batches,
+                                  args=(process.stdout, batch_shape,
+                                        batches, stop_event),
+                                  daemon=True)
+        reader.start()
+
+        frames = batches.get()
+        n_frames = 0
+
+        try:
+            while frames is not None:
+                n_frames += len(frames)
+
+                yield frames
+
+                frames = batches.get()
+        finally:
+            # unblocks the reader thread when the generator is closed early
+            if frames is not None:
+                stop_event.set()
+                process.kill()
+
+            reader.join()
+
+    if process.returncode:
+        # the error itself is ignored by the pipeline, which would otherwise
+        # hide that the output video is incomplete
+        if n_frames:
+            print("%s\n\tDecoding failed after %i frames, the output is "
+                  "incomplete" % (path, n_frames), flush=True)
+
+        raise RuntimeError("Video could not be decoded: %s" % path)
+
+
+def _read_video_batches(stream, batch_shape, batches, stop_event):
+    """Reads batches of raw frames from the decoder output in a background
+       thread, so FFmpeg never stalls on a full pipe while the consumer is
+       busy. The end of the stream is signaled with None.
+
+    Args:
+        stream (object): The binary output stream of the FFmpeg subprocess.
+        batch_shape (tuple, int): The shape of a full batch of frames.
+        batches (object): A bounded queue that receives the batches.
+        stop_event (object): An event that is set to stop reading early.
+    """
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        while not stop_event.is_set():
+            frames = np.empty(batch_shape, np.uint8)
+
+            n_bytes = stream.readinto(memoryview(frames))
+            n_frames = n_bytes // frames[0].nbytes
+
+            if n_frames:
+                put(frames[:n_frames])
+
+            if n_frames < batch_shape[0]:
+                break
+    finally:
+        put(None)
+
+
+def _probe_video(path):
+    """A helper function that reads the number of frames and the original
+       frame size of a video file from its container metadata. The result
+       is kept per file and modification time, since the pipeline needs it
+       several times for every video.
+
+    Args:
+        path (str): The path to the video file.
+
+    Returns:
+        int: The number of frames as stated by the video container.
+        array, int64: 1D array with the height and width of the frames.
+    """
+
+    try:
+        key = (path, os.path.getmtime(path))
+    except OSError:
+        raise FileNotFoundError("Video could not be opened: %s" % path)
+
+    if key in _PROBE_CACHE:
+        n_frames, original_size = _PROBE_CACHE[key]
+        return n_frames, original_size.copy()
+
+    capture = cv2.VideoCapture(path)
+
+    if not capture.isOpened():
+        raise FileNotFoundError("Video could not be opened: %s" % path)
+
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    capture.release()
+
+    original_size = np.array([height, width], np.int64)
+
+    _PROBE_CACHE[key] = (n_frames, original_size)
+
+    return n_frames, original_size.copy()
+
+
+def _get_resized_size(current_size, target_size):
+    """Computes the largest size that fits into the target dimensions while
+       preserving the original aspect ratio, as done in _resize_image.
+
+    Args:
+        current_size (array, int): The height and width of the input.
+        target_size (tuple, int): A tuple that specifies the size to which
+                                  the data will be resized.
+
+    Returns:
+        tuple, int: A tuple with the height and width after resizing.
+    """
+
+    height_ratio = target_size[0] / current_size[0]
+    width_ratio = target_size[1] / current_size[1]
+
+    target_ratio = min(height_ratio, width_ratio)
+
+    resized_size = np.array(current_size, np.float64) * target_ratio
+    resized_size = np.round(resized_size).astype(np.int32)
+
+    return tuple(resized_size)
+
+
+def _parse_image_record(record, target_size):
+    """This function reads the encoded stimulus and ground truth map of a
+       serialized TFRecord example. Both images are then decoded dependent
+       on their type, reshaped, and padded to yield the target
+       dimensionality.
 
     Args:
-        files (tuple, str): A tuple with the paths to all file instances.
-                            The first element contains the stimuli and, if
-                            present, the second one the ground truth maps.
+        record (tensor, str): A serialized example from a TFRecord file.
         target_size (tuple, int): A tuple that specifies the size to which
                                   the data will be reshaped.
 
@@ -375,15 +967,25 @@ def _parse_image_files(files, target_size):
               shapes and file paths.
     """
 
+    features = tf.parse_single_example(record, {
+        "stimulus": tf.FixedLenFeature([], tf.string),
+        "saliency": tf.FixedLenFeature([], tf.string),
+        "stimulus_path": tf.FixedLenFeature([], tf.string),
+        "saliency_path": tf.FixedLenFeature([], tf.string)
+    })
+
+    image_strs = (features["stimulus"], features["saliency"])
+    files = (features["stimulus_path"], features["saliency_path"])
+
     image_list = []
 
-    for count, filename in enumerate(files):
-        image_str = tf.read_file(filename)
+    for count, image_str in enumerate(image_strs):
         channels = 3 if count == 0 else 1
 
         image = tf.cond(tf.image.is_jpeg(image_str),
                         lambda: tf.image.decode_jpeg(image_str,
-                                                     channels=channels),
+                                                     channels=channels,
+                                                     dct_method="INTEGER_FAST"),
                         lambda: tf.image.decode_png(image_str,
                                                     channels=channels))
         original_size = tf.shape(image)[:2]
@@ -452,10 +1054,8 @@ def _resize_image(image, target_size, overfull=False, is_numpy=False):
         target_size = tf.cast(current_size, tf.float64) * target_ratio
         target_size = tf.cast(tf.round(target_size), tf.int32)
 
-        shrinking = tf.cond(tf.logical_or(current_size[0] > target_size[0],
-                                          current_size[1] > target_size[1]),
-                            lambda: tf.constant(True),
-                            lambda: tf.constant(False))
+        shrinking = tf.logical_or(current_size[0] > target_size[0],
+                                  current_size[1] > target_size[1])
 
         image = tf.expand_dims(image, 0)
 
@@ -486,36 +1086,19 @@ def _pad_image(image, target_size):
                                  lambda: tf.constant(126.0),
                                  lambda: tf.constant(0.0))
 
-    pad_vertical = (target_size[0] - current_size[0]) / 2
-    pad_horizontal = (target_size[1] - current_size[1]) / 2
+    pad_vertical = target_size[0] - current_size[0]
+    pad_horizontal = target_size[1] - current_size[1]
 
-    pad_top = tf.floor(pad_vertical)
-    pad_bottom = tf.ceil(pad_vertical)
-    pad_left = tf.floor(pad_horizontal)
-    pad_right = tf.ceil(pad_horizontal)
+    pad_top = pad_vertical // 2
+    pad_bottom = pad_vertical - pad_top
+    pad_left = pad_horizontal // 2
+    pad_right = pad_horizontal - pad_left
 
     padding = [[pad_top, pad_bottom], [pad_left, pad_right], [0, 0]]
     image = tf.pad(image, padding, constant_values=pad_constant_value)
 
     return image
 
-def _np_pad_image(image, target_size):
-    current_size = np.shape(image)
-    pad_constant_value = 126 if current_size[2] == 3 else 0
-    pad_vertical = (target_size[0] - current_size[0]) / 2
-    pad_horizontal = (target_size[1] - current_size[1]) / 2
-
-    pad_top = np.floor(pad_vertical).astype(np.int32)
-    pad_bottom = np.ceil(pad_vertical).astype(np.int32)
-    pad_left = np.floor(pad_horizontal).astype(np.int32)
-    pad_right = np.ceil(pad_horizontal).astype(np.int32)
-
-    padding = [[pad_top, pad_bottom], [pad_left, pad_right], [0, 0]]
-    image = np.pad(
-        image, padding, mode='constant', constant_values=pad_constant_value)
-
-    return image
-
 
 def _crop_image(image, target_size, is_numpy=False):
     """A single saliency map will be cropped according the specified target
@@ -557,35 +1140,63 @@ def _crop_image(image, target_size, is_numpy=False):
     return image
 
 
-def _get_file_list(data_path):
+def _get_file_list(data_path, use_cache=True):
     """This function detects all image files within the specified parent
        directory for either training or testing. The path content cannot
-       be empty, otherwise an error occurs.
+       be empty, otherwise an error occurs. Results are cached per path,
+       so repeated calls do not traverse the file system again.
 
     Args:
         data_path (str): Points to the directory where training or testing
                          data instances are stored.
+        use_cache (bool, optional): Determines whether a cached result may
+                                    be returned instead of traversing the
+                                    file system. Defaults to True.
 
     Returns:
         list, str: A sorted list that holds the paths to all file instances.
     """
 
+    key = os.path.realpath(data_path)
+
+    if use_cache and key in _FILE_LIST_CACHE:
+        return list(_FILE_LIST_CACHE[key])
+
     data_list = []
 
     if os.path.isfile(data_path):
         data_list.append(data_path)
     else:
-        for subdir, dirs, files in os.walk(data_path):
-            for file in files:
-                if file.lower().endswith((".png", ".jpg", ".jpeg", ".avi")):
-                    data_list.append(os.path.join(subdir, file))
+        _scan_directory(data_path, data_list)
 
     data_list.sort()
 
     if not data_list:
         raise FileNotFoundError("No data was found")
 
-    return data_list
+    _FILE_LIST_CACHE[key] = data_list
+
+    return list(data_list)
+
+
+def _scan_directory(data_path, data_list):
+    """A recursive helper function that collects all supported files below
+       a directory. Unlike os.walk, it relies on the entry types returned by
+       os.scandir and hence avoids a stat call for most files.
+
+    Args:
+        data_path (str): Points to the directory that will be scanned.
+        data_list (list, str): The list to which the file paths are appended.
+    """
+
+    with os.scandir(data_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _scan_directory(entry.path, data_list)
+            elif entry.is_file():
+                if entry.name.lower().endswith((".png", ".jpg",
+                                                ".jpeg", ".avi")):
+                    data_list.append(entry.path)
 
 
 def _get_random_indices(list_length):
@@ -616,12 +1227,13 @@ def _check_consistency(zipped_file_lists, n_total_files):
         n_total_files (int): The total number of files expected in the list.
     """
 
-    assert len(list(zipped_file_lists)) == n_total_files, "Files are missing"
+    file_tuples = list(zipped_file_lists)
+
+    assert len(file_tuples) == n_total_files, "Files are missing"
 
-    for file_tuple in zipped_file_lists:
-        file_names = [os.path.basename(entry) for entry in list(file_tuple)]
-        file_names = [os.path.splitext(entry)[0] for entry in file_names]
-        file_names = [entry.replace("_fixMap", "") for entry in file_names]
-        file_names = [entry.replace("_fixPts", "") for entry in file_names]
+    for file_tuple in file_tuples:
+        file_names = {os.path.splitext(os.path.basename(entry))[0]
+                      .replace("_fixMap", "").replace("_fixPts", "")
+                      for entry in file_tuple}
 
-        assert len(set(file_names)) == 1, "File name mismatch"
+        assert len(file_names) == 1, "File name mismatch"
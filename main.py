@@ -1,7 +1,9 @@
 import argparse
+import concurrent.futures
+import itertools
 import os
+import sys
 
-import cv2
 import numpy as np
 import tensorflow as tf
 
@@ -76,16 +78,13 @@ def train_model(dataset, paths, device):
 
     iterator = data.get_dataset_iterator("train", dataset, paths["data"])
 
-    next_element, train_init_op, valid_init_op = iterator
+    next_element, handle, train_iterator, valid_iterator = iterator
 
     input_images, ground_truths = next_element[:2]
 
-    input_plhd = tf.placeholder_with_default(input_images,
-                                             (None, None, None, 3),
-                                             name="input")
     msi_net = model.MSINET()
 
-    predicted_maps = msi_net.forward(input_plhd)
+    predicted_maps = msi_net.forward(input_images)
 
     optimizer, loss = msi_net.train(ground_truths, predicted_maps,
                                     config.PARAMS["learning_rate"])
@@ -109,43 +108,80 @@ def train_model(dataset, paths, device):
                             history.prior_epochs)
 
     with tf.Session() as sess:
-        sess.run(tf.global_variables_initializer())
         saver = msi_net.restore(sess, dataset, paths, device)
 
+        sess.run([train_iterator.initializer, valid_iterator.initializer])
+
+        train_handle, valid_handle = sess.run([train_iterator.string_handle(),
+                                               valid_iterator.string_handle()])
+
         print(">> Start training on %s..." % dataset.upper())
 
-        for epoch in range(config.PARAMS["n_epochs"]):
-            sess.run(train_init_op)
+        try:
+            for epoch in range(config.PARAMS["n_epochs"]):
+                for batch in range(n_train_batches):
+                    _, error = sess.run([optimizer, loss],
+                                        feed_dict={handle: train_handle})
+
+                    history.update_train_step(error)
+                    progbar.update_train_step(batch)
+
+                for batch in range(n_valid_batches):
+                    error = sess.run(loss, feed_dict={handle: valid_handle})
+
+                    history.update_valid_step(error)
+                    progbar.update_valid_step()
+
+                msi_net.save(saver, sess, dataset, paths["latest"], device)
+
+                history.save_history()
+
+                progbar.write_summary(history.get_mean_train_error(),
+                                      history.get_mean_valid_error())
+
+                if history.valid_history[-1] == min(history.valid_history):
+                    msi_net.save(saver, sess, dataset, paths["best"], device)
 
-            for batch in range(n_train_batches):
-                _, error = sess.run([optimizer, loss])
+                    print("\tBest model!", flush=True)
+        except KeyboardInterrupt:
+            # a best checkpoint saved before the interruption is still frozen
+            if _is_frozen_model_outdated(dataset, paths["best"], device):
+                msi_net.optimize(dataset, paths["best"], device)
 
-                history.update_train_step(error)
-                progbar.update_train_step(batch)
+            raise
 
-            sess.run(valid_init_op)
+        # the best checkpoint is frozen for inference only once at the end,
+        # also when it was saved by a prior run
+        if _is_frozen_model_outdated(dataset, paths["best"], device):
+            msi_net.optimize(dataset, paths["best"], device)
 
-            for batch in range(n_valid_batches):
-                error = sess.run(loss)
 
-                history.update_valid_step(error)
-                progbar.update_valid_step()
+def _is_frozen_model_outdated(dataset, path, device):
+    """A helper function that checks whether the best checkpoint is newer
+       than the frozen model used for inference, or the latter is missing.
 
-            msi_net.save(saver, sess, dataset, paths["latest"], device)
+    Args:
+        dataset (str): The dataset used for training.
+        path (str): The path where the best model is saved.
+        device (str): Represents either "cpu" or "gpu".
+
+    Returns:
+        bool: True if the best checkpoint must be frozen again.
+    """
 
-            history.save_history()
+    model_path = path + "model_%s_%s" % (dataset, device)
 
-            progbar.write_summary(history.get_mean_train_error(),
-                                  history.get_mean_valid_error())
+    if not os.path.isfile(model_path + ".ckpt.index"):
+        return False
 
-            if history.valid_history[-1] == min(history.valid_history):
-                msi_net.save(saver, sess, dataset, paths["best"], device)
-                msi_net.optimize(sess, dataset, paths["best"], device)
+    if not os.path.isfile(model_path + ".pb"):
+        return True
 
-                print("\tBest model!", flush=True)
+    return os.path.getmtime(model_path + ".ckpt.index") > \
+        os.path.getmtime(model_path + ".pb")
 
 
-def test_model(dataset, paths, device):
+def test_model(dataset, paths, device, serve=False):
     """The main function for executing network testing. It loads the specified
        dataset iterator and optimized saliency model. By default, when no model
        checkpoint is found locally, the pretrained weights will be downloaded.
@@ -156,84 +192,203 @@ def test_model(dataset, paths, device):
         dataset (str): Denotes the dataset that was used during training.
         paths (dict, str): A dictionary with all path elements.
         device (str): Represents either "cpu" or "gpu".
+        serve (bool, optional): Keeps the model loaded after testing and reads
+                                further video paths from stdin, one per line.
+                                Defaults to False.
     """
 
-    video_file = tf.placeholder(tf.string, shape=())
-    iterator = data.get_dataset_iterator("test", dataset, paths["data"], video_file)
+    model_name = "model_%s_%s.pb" % (dataset, device)
+    trt_model_name = "model_%s_%s_trt.pb" % (dataset, device)
+
+    has_best_model = os.path.isfile(paths["best"] + model_name)
+
+    # the pretrained weights are downloaded while the input graph is built
+    download_future = None
+
+    if not has_best_model and \
+       not os.path.isfile(paths["weights"] + model_name):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        download_future = executor.submit(
+            download.download_pretrained_weights,
+            paths["weights"], model_name[:-3])
+        executor.shutdown(wait=False)
+
+    files_plhd = tf.placeholder(tf.string, shape=(None,))
+    iterator = data.get_dataset_iterator("test", dataset,
+                                         paths["data"], files_plhd)
 
     next_element, init_op = iterator
 
-    input_images, original_shape, file_path = next_element
+    input_images, file_path = next_element
 
-    graph_def = tf.GraphDef()
+    predicted_maps = None
 
-    model_name = "model_%s_%s.pb" % (dataset, device)
+    # the TensorRT model is only usable once its ops have been registered
+    if os.path.isfile(paths["best"] + trt_model_name) and _load_tensorrt():
+        graph_def = _read_graph_def(paths["best"] + trt_model_name)
 
-    if os.path.isfile(paths["best"] + model_name):
-        with tf.gfile.Open(paths["best"] + model_name, "rb") as file:
-            graph_def.ParseFromString(file.read())
-    else:
-        if not os.path.isfile(paths["weights"] + model_name):
-            download.download_pretrained_weights(paths["weights"],
-                                                 model_name[:-3])
+        try:
+            [predicted_maps] = tf.import_graph_def(
+                graph_def, input_map={"input": input_images},
+                return_elements=["output:0"])
+        except (ValueError, tf.errors.OpError):
+            predicted_maps = None
+
+    if predicted_maps is None:
+        if has_best_model:
+            graph_def = _read_graph_def(paths["best"] + model_name)
+        else:
+            if download_future is not None:
+                download_future.result()
 
-        with tf.gfile.Open(paths["weights"] + model_name, "rb") as file:
-            graph_def.ParseFromString(file.read())
+            graph_def = _read_graph_def(paths["weights"] + model_name)
 
-    [predicted_maps] = tf.import_graph_def(graph_def,
-                                           input_map={"input": input_images},
-                                           return_elements=["output:0"])
+        [predicted_maps] = tf.import_graph_def(
+            graph_def, input_map={"input": input_images},
+            return_elements=["output:0"])
+
+    # frames are quantized on the device, which also shrinks the transfer
+    predicted_maps = tf.saturate_cast(tf.round(predicted_maps[..., 0] * 255.0),
+                                      tf.uint8)
 
     print(">> Start testing with %s %s model..." % (dataset.upper(), device))
 
-    with tf.Session() as sess:
+    session_config = tf.ConfigProto()
+
+    # compiles the imported graph with xla to fuse kernels on the gpu
+    if device == "gpu":
+        session_config.graph_options.optimizer_options.global_jit_level = \
+            tf.OptimizerOptions.ON_1
+
+    with tf.Session(config=session_config) as sess:
+
+        data_paths = [paths["data"]]
+
+        # the session stays open and processes further paths read from stdin
+        if serve:
+            data_paths = itertools.chain(data_paths, _read_data_paths())
+
+        for data_path in data_paths:
+            try:
+                # listings are read again, since directories may change
+                # while the session is running
+                video_files = data._get_file_list(data_path,
+                                                  use_cache=not serve)
+            except FileNotFoundError:
+                if not serve:
+                    raise
+
+                print("%s\n\tSkipped, no data was found" % data_path,
+                      flush=True)
+                continue
+
+            commonpath = os.path.commonpath([data_path, paths["images"]])
+
+            out = None
+            current_file_path = None
+            processed_files = set()
+
+            sess.run(init_op, feed_dict={files_plhd: video_files})
 
-        video_files = data._get_file_list(paths["data"])
-        for vf in video_files:
-            print(vf)
-            saliency_images_list = []
-            sess.run(init_op, feed_dict={video_file:vf})
             while True:
                 try:
-                    saliency_images, target_shape, np_file_path = \
-                        sess.run([predicted_maps, original_shape, file_path],
-                            feed_dict={video_file:vf})
-                    saliency_images_list.append(saliency_images)
+                    saliency_images, np_file_path = \
+                        sess.run([predicted_maps, file_path])
                 except tf.errors.OutOfRangeError:
                     break
 
-            saliency_video = np.concatenate(saliency_images_list)
-            target_shape = target_shape[0]
-            np_file_path = np_file_path[0][0]
-
-            commonpath = os.path.commonpath(
-                [paths["data"], paths["images"]])
-            file_path_str = np_file_path.decode("utf8")
-            relative_file_path = os.path.relpath(
-                file_path_str, start=commonpath)
-            output_file_path = os.path.join(
-                paths["images"], relative_file_path)
-            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            frame_size = (target_shape[1], target_shape[0])
-            frame_size = (saliency_video.shape[2], saliency_video.shape[1])
-            out = cv2.VideoWriter(
-                output_file_path, fourcc, 25, frame_size, False)
-
-            saliency_video = np.squeeze(saliency_video)
-            saliency_video *= 255
-            for frame in saliency_video:
-                saliency_map = data._resize_image(
-                    frame, target_shape, True, is_numpy=True)
-                saliency_map = data._crop_image(
-                    saliency_map, target_shape, is_numpy=True)
-
-                saliency_map = np.round(frame)
-                saliency_map = saliency_map.astype(np.uint8)
-
-                out.write(saliency_map)
-            out.release()
+                file_path_str = np_file_path.decode("utf8")
+
+                # frames arrive grouped by video, so a new path starts a file
+                if file_path_str != current_file_path:
+                    if out is not None:
+                        out.release()
+
+                    print(file_path_str)
+
+                    current_file_path = file_path_str
+                    processed_files.add(file_path_str)
+
+                    relative_file_path = os.path.relpath(
+                        file_path_str, start=commonpath)
+                    output_file_path = os.path.join(
+                        paths["images"], relative_file_path)
+                    os.makedirs(os.path.dirname(output_file_path),
+                                exist_ok=True)
+
+                    frame_size = (saliency_images.shape[2],
+                                  saliency_images.shape[1])
+                    out = data.get_video_writer(output_file_path, frame_size)
+
+                for saliency_map in saliency_images:
+                    out.write(saliency_map)
+
+            if out is not None:
+                out.release()
+
+            for vf in video_files:
+                if vf not in processed_files:
+                    print("%s\n\tSkipped, no frames could be decoded" % vf,
+                          flush=True)
+
+
+def _load_tensorrt():
+    """A helper function that loads the TensorRT module, which registers the
+       ops required by models converted with TensorRT.
+
+    Returns:
+        bool: True if TensorRT support could be loaded.
+    """
+
+    # a missing libnvinfer raises a NotFoundError instead of ImportError
+    try:
+        from tensorflow.contrib import tensorrt
+    except (ImportError, tf.errors.NotFoundError):
+        return False
+
+    return True
+
+
+def _read_graph_def(path):
+    """A helper function that reads a frozen model from disk.
+
+    Args:
+        path (str): The path to the frozen model file.
+
+    Returns:
+        object: The parsed graph definition.
+    """
+
+    graph_def = tf.GraphDef()
+
+    with tf.gfile.Open(path, "rb") as file:
+        graph_def.ParseFromString(file.read())
+
+    return graph_def
+
+
+def _read_data_paths():
+    """A helper generator that reads paths to video files or directories from
+       stdin until it is closed. Relative paths are made absolute, so they can
+       be related to the output directory.
+
+    Yields:
+        str: The path to a video file or a directory with video files.
+    """
+
+    print(">> Waiting for video paths on stdin...", flush=True)
+
+    for line in sys.stdin:
+        data_path = line.strip()
+
+        if data_path:
+            data_path = os.path.abspath(data_path)
+
+            if os.path.isfile(data_path):
+                yield data_path
+            else:
+                yield os.path.join(data_path, "")
+
 
 def main():
     """The main function reads the command line arguments, invokes the
@@ -262,6 +417,10 @@ def main():
                         help="specify the path where training data will be \
                               downloaded to or test data is stored")
 
+    parser.add_argument("-s", "--serve", action="store_true",
+                        help="keep the model loaded after testing and read \
+                              further video paths from stdin")
+
     args = parser.parse_args()
 
     paths = define_paths(current_path, args)
@@ -269,7 +428,7 @@ def main():
     if args.phase == "train":
         train_model(args.data, paths, config.PARAMS["device"])
     elif args.phase == "test":
-        test_model(args.data, paths, config.PARAMS["device"])
+        test_model(args.data, paths, config.PARAMS["device"], args.serve)
 
 
 if __name__ == "__main__":
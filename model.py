@@ -378,7 +378,8 @@ class MSINET:
         """This function allows continued training from a prior checkpoint and
            training from scratch with the pretrained VGG16 weights. In case the
            dataset is either CAT2000 or MIT1003, a prior checkpoint based on
-           the SALICON dataset is required.
+           the SALICON dataset is required. All variables that are not part
+           of the restored checkpoint are then initialized.
 
         Args:
             sess (object): The current TF training session.
@@ -418,14 +419,25 @@ class MSINET:
             loader = tf.train.Saver(self._mapping)
             loader.restore(sess, paths["weights"] + vgg16_name + ".ckpt")
 
+        # only variables that were not restored from a checkpoint are set
+        uninitialized_names = set(sess.run(
+            tf.report_uninitialized_variables()))
+
+        uninitialized_vars = [var for var in tf.global_variables()
+                              if var.op.name.encode() in uninitialized_names]
+
+        sess.run(tf.variables_initializer(uninitialized_vars))
+
         return saver
 
-    def optimize(self, sess, dataset, path, device):
-        """The best performing model is frozen, optimized for inference
-           by removing unneeded training operations, and written to disk.
+    def optimize(self, dataset, path, device):
+        """The best performing model is rebuilt in a separate inference graph
+           that is fed through an input placeholder. It is then frozen with
+           the weights of the best checkpoint, optimized for inference by
+           removing unneeded operations, and written to disk.
 
         Args:
-            sess (object): The current TF training session.
+            dataset (str): The dataset used for training.
             path (str): The path used for saving the model.
             device (str): Represents either "cpu" or "gpu".
 
@@ -435,13 +447,22 @@ class MSINET:
         model_name = "model_%s_%s" % (dataset, device)
         model_path = path + model_name
 
-        tf.train.write_graph(sess.graph.as_graph_def(),
-                             path, model_name + ".pbtxt")
+        with tf.Graph().as_default() as graph:
+            input_plhd = tf.placeholder(tf.float32, (None, None, None, 3),
+                                        name="input")
+
+            MSINET().forward(input_plhd)
 
-        freeze_graph.freeze_graph(model_path + ".pbtxt", "", False,
-                                  model_path + ".ckpt", "output",
-                                  "save/restore_all", "save/Const:0",
-                                  model_path + ".pb", True, "")
+            tf.train.Saver()
+
+            tf.train.write_graph(graph.as_graph_def(),
+                                 path, model_name + ".pbtxt")
+
+        with tf.Graph().as_default():
+            freeze_graph.freeze_graph(model_path + ".pbtxt", "", False,
+                                      model_path + ".ckpt", "output",
+                                      "save/restore_all", "save/Const:0",
+                                      model_path + ".pb", True, "")
 
         os.remove(model_path + ".pbtxt")
 
@@ -464,3 +485,43 @@ class MSINET:
                              logdir=path,
                              as_text=False,
                              name=model_name + ".pb")
+
+        # an older TensorRT model would otherwise be preferred during testing
+        if os.path.isfile(model_path + "_trt.pb"):
+            os.remove(model_path + "_trt.pb")
+
+        if device == "gpu":
+            self._optimize_tensorrt(optimized_graph_def, path, model_name)
+
+    def _optimize_tensorrt(self, graph_def, path, model_name):
+        """Additionally converts the optimized gpu model with TensorRT, which
+           fuses layers into single kernels running at half precision. The
+           result is stored next to the regular model and preferred during
+           testing. It is skipped when TensorRT support is not installed or
+           the conversion fails, which leaves the regular model in place.
+
+        Args:
+            graph_def (object): The frozen and optimized graph definition.
+            path (str): The path used for saving the model.
+            model_name (str): The file name of the model without extension.
+        """
+
+        # a missing libnvinfer raises a NotFoundError instead of ImportError
+        try:
+            from tensorflow.contrib import tensorrt as trt
+        except (ImportError, tf.errors.NotFoundError):
+            return
+
+        try:
+            trt_graph_def = trt.create_inference_graph(
+                graph_def, ["output"],
+                max_batch_size=config.PARAMS["test_batch_size"],
+                precision_mode="FP16",
+                is_dynamic_op=True)
+        except Exception:
+            return
+
+        tf.train.write_graph(trt_graph_def,
+                             logdir=path,
+                             as_text=False,
+                             name=model_name + "_trt.pb")